@@ -3,115 +3,183 @@ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 SPDX-License-Identifier: Apache-2.0
 """
 
+import array
 import hashlib
 import json
 import logging
 import os
 from collections import defaultdict
-from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
 
 import boto3
 
 from solution.application import __boto_config__
 from solution.application.glacier_service.glacier_typing import GlacierJobType
 from solution.application.model.glacier_transfer_meta_model import (
-    GlacierTransferMetadata,
+    GlacierTransferMetadataStatus,
 )
 from solution.application.model.glacier_transfer_model import GlacierTransferModel
+from solution.application.util.exceptions import TransactionItemLimitExceeded
 from solution.application.util.retry import retry
 from solution.infrastructure.output_keys import OutputKeys
 
 if TYPE_CHECKING:
     from mypy_boto3_dynamodb import DynamoDBClient
-    from mypy_boto3_dynamodb.type_defs import TransactWriteItemTypeDef
+    from mypy_boto3_dynamodb.type_defs import (
+        AttributeValueTypeDef,
+        TransactWriteItemTypeDef,
+    )
 else:
     DynamoDBClient = object
+    AttributeValueTypeDef = object
     TransactWriteItemTypeDef = object
 
 
 logger = logging.getLogger()
 logger.setLevel(int(os.environ.get("LOGGING_LEVEL", logging.INFO)))
 
+# Records per invocation from the status change stream. Each record touches at most
+# one workflow run, so a batch never exceeds a single transaction.
+STATUS_CHANGE_BATCH_SIZE = 20
+# https://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_TransactWriteItems.html
+TRANSACT_WRITE_ITEMS_LIMIT = 100
+
+# Slots of a workflow run's metrics array
+METRIC_SLOTS = 6
+(
+    REQUESTED_COUNT,
+    REQUESTED_SIZE,
+    STAGED_COUNT,
+    STAGED_SIZE,
+    DOWNLOADED_COUNT,
+    DOWNLOADED_SIZE,
+) = range(METRIC_SLOTS)
+
+_STATUS_TO_INDEX: Dict[str, Tuple[int, int]] = {
+    GlacierTransferModel.StatusCode.REQUESTED: (REQUESTED_COUNT, REQUESTED_SIZE),
+    GlacierTransferModel.StatusCode.STAGED: (STAGED_COUNT, STAGED_SIZE),
+    GlacierTransferModel.StatusCode.DOWNLOADED: (DOWNLOADED_COUNT, DOWNLOADED_SIZE),
+}
+
+# old status ("" for a new item) -> new status -> metric slots to increment
+_STATUS_TRANSITIONS: Dict[str, Dict[str, Tuple[int, int]]] = {
+    "": {
+        GlacierTransferModel.StatusCode.REQUESTED: _STATUS_TO_INDEX[
+            GlacierTransferModel.StatusCode.REQUESTED
+        ],
+    },
+    GlacierTransferModel.StatusCode.REQUESTED: {
+        GlacierTransferModel.StatusCode.STAGED: _STATUS_TO_INDEX[
+            GlacierTransferModel.StatusCode.STAGED
+        ],
+    },
+    GlacierTransferModel.StatusCode.STAGED: {
+        GlacierTransferModel.StatusCode.DOWNLOADED: _STATUS_TO_INDEX[
+            GlacierTransferModel.StatusCode.DOWNLOADED
+        ],
+    },
+}
+_NO_TRANSITIONS: Dict[str, Tuple[int, int]] = {}
+
+# Placeholders follow the slot order of the metrics array
+_ATTRIBUTE_KEYS: Tuple[str, ...] = tuple(
+    f":update_{status}_{attribute_type}"
+    for status in _STATUS_TO_INDEX
+    for attribute_type in ("count", "size")
+)
+_UPDATE_EXPRESSION = "ADD " + ", ".join(
+    f"{attribute_type}_{status} :update_{status}_{attribute_type}"
+    for status in _STATUS_TO_INDEX
+    for attribute_type in ("count", "size")
+)
+
+_DDB_CLIENT: Optional[DynamoDBClient] = None
+
+
+def _get_ddb_client() -> DynamoDBClient:
+    # Reuse the client across retries and warm Lambda invocations
+    global _DDB_CLIENT
+    if _DDB_CLIENT is None:
+        _DDB_CLIENT = boto3.client("dynamodb", config=__boto_config__)
+    return _DDB_CLIENT
+
+
+def _extract_status(image: dict[str, Any]) -> str:
+    # Only the status is needed from the old image, so skip parsing the full model
+    return str(image["retrieve_status"]["S"]).rpartition("/")[2]
+
+
+def _iter_image_pairs(
+    records: List[dict[str, Any]]
+) -> Iterator[Tuple[dict[str, Any], Optional[dict[str, Any]]]]:
+    # OldImage is None for INSERT records
+    for record in records:
+        if record.get("eventSource") != "aws:dynamodb":
+            continue
+        event_name = record.get("eventName")
+        if event_name == "INSERT":
+            yield record["dynamodb"]["NewImage"], None
+        elif event_name == "MODIFY":
+            yield record["dynamodb"]["NewImage"], record["dynamodb"]["OldImage"]
+
+
+def _metric_attribute_values(
+    metrics: "array.array[int]",
+) -> Dict[str, AttributeValueTypeDef]:
+    return {key: {"N": str(value)} for key, value in zip(_ATTRIBUTE_KEYS, metrics)}
+
 
 class StatusMetricController:
     def __init__(self, records: List[dict[str, Any]]) -> None:
-        self.counted_logs: List[str] = []
         self.records = records
-        self.workflow_run_metrics: Dict[str, Dict[str, int]] = defaultdict(
+        self.workflow_run_metrics: Dict[str, "array.array[int]"] = defaultdict(
             self._initial_metric
         )
-        self.client_request_token = self._generate_client_request_token(records)
-
-    def _initial_metric(self) -> Dict[str, int]:
-        return {
-            "requested_count": 0,
-            "requested_size": 0,
-            "staged_count": 0,
-            "staged_size": 0,
-            "downloaded_count": 0,
-            "downloaded_size": 0,
-        }
+
+    def _initial_metric(self) -> "array.array[int]":
+        return array.array("q", [0] * METRIC_SLOTS)
 
     def _generate_client_request_token(self, records: List[dict[str, Any]]) -> str:
-        token = hashlib.sha256(json.dumps(records, sort_keys=True).encode()).hexdigest()
-        # Slice to extract every other hexadecimal character and concatenate the last 4 characters to generate a 36 character long token
-        return token[::2] + token[-4:]
+        # An 18 byte digest hex-encodes to the 36 character ClientRequestToken limit
+        return hashlib.blake2b(
+            json.dumps(records, sort_keys=True).encode(), digest_size=18
+        ).hexdigest()
+
+    @cached_property
+    def client_request_token(self) -> str:
+        # Only built when a transaction is written, then reused across retries
+        return self._generate_client_request_token(self.records)
 
     def handle_archive_status_changed(self) -> None:
-        for record in self.records:
-            if record.get("eventSource") == "aws:dynamodb":
-                if record.get("eventName") == "INSERT":
-                    self.increase_archive_status_metric_counter(
-                        record["dynamodb"]["NewImage"]
-                    )
-                elif record.get("eventName") == "MODIFY":
-                    self.increase_archive_status_metric_counter(
-                        record["dynamodb"]["NewImage"], record["dynamodb"]["OldImage"]
-                    )
+        increase_counter = self.increase_archive_status_metric_counter
+        for new_image, old_image in _iter_image_pairs(self.records):
+            increase_counter(new_image, old_image)
+        if len(self.workflow_run_metrics) > TRANSACT_WRITE_ITEMS_LIMIT:
+            raise TransactionItemLimitExceeded(
+                len(self.workflow_run_metrics), TRANSACT_WRITE_ITEMS_LIMIT
+            )
         self.update_metric_query()
 
     @retry(max_retries=10, raise_exception=True)
     def update_metric_query(self) -> None:
         if self.records:
-            ddb_client: DynamoDBClient = boto3.client(
-                "dynamodb", config=__boto_config__
-            )
-
-            transact_items: List[TransactWriteItemTypeDef] = []
-            for workflow_run, metrics in self.workflow_run_metrics.items():
-                expression_attribute_values = {}
-                updates = []
-
-                for attribute_status in (
-                    GlacierTransferModel.StatusCode.REQUESTED,
-                    GlacierTransferModel.StatusCode.STAGED,
-                    GlacierTransferModel.StatusCode.DOWNLOADED,
-                ):
-                    for attribute_type in ("count", "size"):
-                        attribute_key = f":update_{attribute_status}_{attribute_type}"
-                        attribute_value = str(
-                            metrics[f"{attribute_status}_{attribute_type}"]
-                        )
-                        expression_attribute_values[attribute_key] = {
-                            "N": attribute_value
-                        }
-
-                        updates.append(
-                            f"{attribute_type}_{attribute_status} {attribute_key}"
-                        )
-
-                update_expression = ", ".join(updates)
-
-                transact_items.append(
-                    {
-                        "Update": {
-                            "TableName": os.environ[OutputKeys.METRIC_TABLE_NAME],
-                            "Key": {"pk": {"S": workflow_run}},
-                            "UpdateExpression": f"ADD {update_expression}",
-                            "ExpressionAttributeValues": expression_attribute_values,
-                        },
-                    }
-                )
+            ddb_client = _get_ddb_client()
+            table_name = os.environ[OutputKeys.METRIC_TABLE_NAME]
+
+            # The batch is written atomically, and the token derived from it turns a
+            # redelivery of an already written batch into a no-op.
+            transact_items: List[TransactWriteItemTypeDef] = [
+                {
+                    "Update": {
+                        "TableName": table_name,
+                        "Key": {"pk": {"S": workflow_run}},
+                        "UpdateExpression": _UPDATE_EXPRESSION,
+                        "ExpressionAttributeValues": _metric_attribute_values(metrics),
+                    },
+                }
+                for workflow_run, metrics in self.workflow_run_metrics.items()
+            ]
 
             if transact_items:
                 ddb_client.transact_write_items(
@@ -119,57 +187,46 @@ class StatusMetricController:
                     ClientRequestToken=self.client_request_token,
                 )
 
-            for entry in self.counted_logs:
-                logger.info(entry)
+            counted = sum(
+                metrics[count_index]
+                for metrics in self.workflow_run_metrics.values()
+                for count_index, _ in _STATUS_TO_INDEX.values()
+            )
+            logger.info(
+                "Counted %d status transitions across %d workflow runs",
+                counted,
+                len(self.workflow_run_metrics),
+            )
 
     def increase_archive_status_metric_counter(
         self, new_image: dict[str, Any], old_image: Optional[dict[str, Any]] = None
     ) -> None:
-        new_metadata = GlacierTransferMetadata.parse(new_image)
+        new_metadata = GlacierTransferMetadataStatus.parse(new_image)
         workflow_run = new_metadata.workflow_run
 
         if new_metadata.retrieval_type != GlacierJobType.ARCHIVE_RETRIEVAL:
             return
 
         if not new_metadata.size or not new_metadata.archive_id:
-            logger.error(f"Failed to read archive's metadata from {new_metadata}")
+            logger.error("Failed to read archive's metadata from %s", new_metadata)
             return
 
-        new_status = new_metadata.retrieve_status.split("/")[-1]
-        old_status = (
-            GlacierTransferMetadata.parse(old_image).retrieve_status.split("/")[-1]
-            if old_image
-            else None
+        new_status = new_metadata.status_suffix
+        old_status = _extract_status(old_image) if old_image else ""
+        metric_slots = _STATUS_TRANSITIONS.get(old_status, _NO_TRANSITIONS).get(
+            new_status
         )
 
-        status_mapping = {
-            (
-                None,
-                GlacierTransferModel.StatusCode.REQUESTED,
-            ): GlacierTransferModel.StatusCode.REQUESTED,
-            (
-                GlacierTransferModel.StatusCode.REQUESTED,
-                GlacierTransferModel.StatusCode.STAGED,
-            ): GlacierTransferModel.StatusCode.STAGED,
-            (
-                GlacierTransferModel.StatusCode.STAGED,
-                GlacierTransferModel.StatusCode.DOWNLOADED,
-            ): GlacierTransferModel.StatusCode.DOWNLOADED,
-        }
-        result_status = status_mapping.get((old_status, new_status), None)
-
-        archive_id = GlacierTransferModel(
-            workflow_run=new_metadata.workflow_run,
-            glacier_object_id=new_metadata.archive_id,
-        ).key["pk"]
-        if result_status:
-            logger.debug(f"Archive:{archive_id} - handled_status:{new_status}")
-            self.counted_logs.append(
-                f"Archive:{archive_id} - counted_status:{new_status}"
-            )
-            self.workflow_run_metrics[workflow_run][f"{result_status}_count"] += 1
-            self.workflow_run_metrics[workflow_run][
-                f"{result_status}_size"
-            ] += new_metadata.size
+        if metric_slots:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Archive:%s - handled_status:%s", new_image["pk"]["S"], new_status
+                )
+            count_index, size_index = metric_slots
+            metrics = self.workflow_run_metrics[workflow_run]
+            metrics[count_index] += 1
+            metrics[size_index] += new_metadata.size
         else:
-            logger.info(f"Archive:{archive_id} - unhandled_status:{new_status}")
+            logger.info(
+                "Archive:%s - unhandled_status:%s", new_image["pk"]["S"], new_status
+            )
@@ -3,7 +3,7 @@ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 SPDX-License-Identifier: Apache-2.0
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
 from solution.application.model.base import Model
@@ -15,6 +15,19 @@ class GlacierTransferMetadataRead(GlacierTransferModel):
     sk: str = Model.field(["sk", "S"], default="meta")
 
 
+@dataclass
+class GlacierTransferMetadataStatus(GlacierTransferMetadataRead):
+    retrieval_type: str = Model.field(["retrieval_type", "S"])
+    retrieve_status: str = Model.field(["retrieve_status", "S"])
+    size: int | None = Model.field(["size", "N"], marshal_as=str)
+    archive_id: str | None = Model.field(["archive_id", "S"], optional=True)
+    status_suffix: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # retrieve_status is stored as "<workflow_run>/<status>"
+        self.status_suffix = self.retrieve_status.rpartition("/")[2]
+
+
 @dataclass
 class GlacierTransferMetadata(GlacierTransferMetadataRead):
     job_id: str = Model.field(["job_id", "S"])
@@ -58,3 +58,11 @@ class MaximumRetryLimitExceeded(Exception):
             f"Maximum retry limit {max_retries} exceeded. Exception: {message}"
         )
         super().__init__(self.message)
+
+
+class TransactionItemLimitExceeded(Exception):
+    def __init__(self, items_count: int, limit: int) -> None:
+        self.message = (
+            f"Transaction of {items_count} items exceeds the limit of {limit} items"
+        )
+        super().__init__(self.message)
@@ -30,6 +30,7 @@ from cdk_nag import NagSuppressions
 from constructs import Construct
 
 from solution.application.glacier_service.glacier_typing import GlacierJobType
+from solution.application.metrics.status_controller import STATUS_CHANGE_BATCH_SIZE
 from solution.infrastructure.helpers.logs_insights_query import LogsInsightsQuery
 from solution.infrastructure.helpers.solutions_function import SolutionsPythonFunction
 from solution.infrastructure.helpers.solutions_table import SolutionsTable
@@ -535,7 +536,7 @@ class SolutionStack(Stack):
                         }
                     )
                 ],
-                batch_size=20,
+                batch_size=STATUS_CHANGE_BATCH_SIZE,
                 parallelization_factor=1,
                 max_batching_window=Duration.seconds(300),
                 retry_attempts=MAX_RETRY_ATTEMPTS,
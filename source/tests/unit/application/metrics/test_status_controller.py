@@ -2,6 +2,7 @@
 Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 SPDX-License-Identifier: Apache-2.0
 """
+import logging
 import os
 from typing import Any, Dict, List, Optional
 from unittest.mock import MagicMock, patch
@@ -10,10 +11,14 @@ import pytest
 from mypy_boto3_dynamodb import DynamoDBClient
 from mypy_boto3_dynamodb.type_defs import CreateTableOutputTypeDef
 
+from solution.application.metrics import status_controller
 from solution.application.metrics.status_controller import StatusMetricController
 from solution.application.model.glacier_transfer_model import GlacierTransferModel
 from solution.application.model.metric_record import MetricRecord
-from solution.application.util.exceptions import MaximumRetryLimitExceeded
+from solution.application.util.exceptions import (
+    MaximumRetryLimitExceeded,
+    TransactionItemLimitExceeded,
+)
 from solution.infrastructure.output_keys import OutputKeys
 
 WORKFLOW_RUN_1 = "workflow_run_orchestrator_1"
@@ -154,15 +159,15 @@ def test_handle_archive_status_changed(
     assert ddb_metric_2.size_downloaded == ARCHIVE_CHANGED_COUNT * ARCHIVE_SIZE
 
 
-@patch("boto3.client")
+@patch("solution.application.metrics.status_controller._get_ddb_client")
 def test_handle_archive_status_changed_retry(
-    boto3_client_mock: MagicMock,
+    ddb_client_mock: MagicMock,
     dynamodb_client: DynamoDBClient,
     mock_records: List[dict[str, Any]],
     metric_table_mock: CreateTableOutputTypeDef,
 ) -> None:
     controller = StatusMetricController(records=mock_records)
-    boto3_client_mock.return_value.transact_write_items.side_effect = Exception(
+    ddb_client_mock.return_value.transact_write_items.side_effect = Exception(
         "TransactionConflict exception"
     )
 
@@ -174,6 +179,106 @@ def test_handle_archive_status_changed_retry(
     )
 
 
+@patch("boto3.client")
+def test_ddb_client_is_reused(boto3_client_mock: MagicMock) -> None:
+    with patch.object(status_controller, "_DDB_CLIENT", None):
+        first_client = status_controller._get_ddb_client()
+        second_client = status_controller._get_ddb_client()
+
+    assert first_client is second_client
+    boto3_client_mock.assert_called_once()
+
+
+@patch("solution.application.metrics.status_controller._get_ddb_client")
+def test_update_metric_query_single_transaction(
+    ddb_client_mock: MagicMock,
+    mock_records: List[dict[str, Any]],
+) -> None:
+    controller = StatusMetricController(records=mock_records)
+    controller.handle_archive_status_changed()
+
+    ddb_client_mock.return_value.transact_write_items.assert_called_once()
+    call = ddb_client_mock.return_value.transact_write_items.call_args
+    assert sorted(
+        item["Update"]["Key"]["pk"]["S"] for item in call.kwargs["TransactItems"]
+    ) == [WORKFLOW_RUN_1, WORKFLOW_RUN_2]
+    assert call.kwargs["ClientRequestToken"] == controller.client_request_token
+
+
+def test_status_change_batch_fits_one_transaction() -> None:
+    assert (
+        status_controller.STATUS_CHANGE_BATCH_SIZE
+        <= status_controller.TRANSACT_WRITE_ITEMS_LIMIT
+    )
+
+
+@patch("solution.application.metrics.status_controller._get_ddb_client")
+def test_handle_archive_status_changed_transaction_limit(
+    ddb_client_mock: MagicMock,
+) -> None:
+    records = [
+        {
+            "eventName": "INSERT",
+            "eventSource": "aws:dynamodb",
+            "dynamodb": {
+                "NewImage": mock_image(
+                    f"workflow_run_{index}", GlacierTransferModel.StatusCode.REQUESTED
+                ),
+            },
+        }
+        for index in range(status_controller.TRANSACT_WRITE_ITEMS_LIMIT + 1)
+    ]
+
+    with pytest.raises(TransactionItemLimitExceeded):
+        StatusMetricController(records=records).handle_archive_status_changed()
+    ddb_client_mock.return_value.transact_write_items.assert_not_called()
+
+
+def test_handle_archive_status_changed_redelivery(
+    dynamodb_client: DynamoDBClient,
+    metric_table_mock: CreateTableOutputTypeDef,
+) -> None:
+    workflow_runs = ("workflow_run_redelivery_1", "workflow_run_redelivery_2")
+    records = [
+        {
+            "eventName": "INSERT",
+            "eventSource": "aws:dynamodb",
+            "dynamodb": {
+                "NewImage": mock_image(
+                    workflow_run, GlacierTransferModel.StatusCode.REQUESTED
+                ),
+            },
+        }
+        for workflow_run in workflow_runs
+    ]
+
+    # The first delivery fails on every attempt, the stream then redelivers the batch
+    with patch(
+        "solution.application.metrics.status_controller._get_ddb_client"
+    ) as failing_client_mock:
+        failing_client_mock.return_value.transact_write_items.side_effect = Exception(
+            "TransactionConflict exception"
+        )
+        with pytest.raises(MaximumRetryLimitExceeded):
+            StatusMetricController(records=records).handle_archive_status_changed()
+
+    with patch(
+        "solution.application.metrics.status_controller._get_ddb_client",
+        return_value=dynamodb_client,
+    ):
+        StatusMetricController(records=records).handle_archive_status_changed()
+
+    for workflow_run in workflow_runs:
+        metric = MetricRecord.parse(
+            dynamodb_client.get_item(
+                TableName=os.environ[OutputKeys.METRIC_TABLE_NAME],
+                Key={"pk": {"S": workflow_run}},
+            )["Item"]
+        )
+        assert metric.count_requested == 1
+        assert metric.size_requested == ARCHIVE_SIZE
+
+
 def test_token_length(mock_records: List[dict[str, Any]]) -> None:
     controller = StatusMetricController(records=mock_records)
     token = controller._generate_client_request_token(mock_records)
@@ -183,6 +288,31 @@ def test_token_length(mock_records: List[dict[str, Any]]) -> None:
     assert len(token) <= 36
 
 
+@patch.object(StatusMetricController, "_generate_client_request_token")
+@patch("solution.application.metrics.status_controller._get_ddb_client")
+def test_token_not_generated_without_transaction(
+    ddb_client_mock: MagicMock, generate_token_mock: MagicMock
+) -> None:
+    records = [
+        {
+            "eventName": "MODIFY",
+            "eventSource": "aws:dynamodb",
+            "dynamodb": {
+                "NewImage": mock_image(
+                    WORKFLOW_RUN_1, GlacierTransferModel.StatusCode.STAGED
+                ),
+                "OldImage": mock_image(
+                    WORKFLOW_RUN_1, GlacierTransferModel.StatusCode.STAGED
+                ),
+            },
+        }
+    ]
+    StatusMetricController(records=records).handle_archive_status_changed()
+
+    ddb_client_mock.return_value.transact_write_items.assert_not_called()
+    generate_token_mock.assert_not_called()
+
+
 def test_increase_archive_status_metric_counter() -> None:
     controller = StatusMetricController(records=[])
 
@@ -194,14 +324,91 @@ def test_increase_archive_status_metric_counter() -> None:
     controller.increase_archive_status_metric_counter(new_image_1)
     controller.increase_archive_status_metric_counter(new_image_2, old_image_2)
 
-    print(controller.workflow_run_metrics[WORKFLOW_RUN_1])
+    metrics = controller.workflow_run_metrics[WORKFLOW_RUN_1]
+
+    assert metrics[status_controller.REQUESTED_COUNT] == 1
+    assert metrics[status_controller.REQUESTED_SIZE] == ARCHIVE_SIZE
+    assert metrics[status_controller.STAGED_COUNT] == 1
+    assert metrics[status_controller.STAGED_SIZE] == ARCHIVE_SIZE
+
+
+def test_increase_archive_status_metric_counter_unhandled_transition() -> None:
+    controller = StatusMetricController(records=[])
+
+    old_image = mock_image(WORKFLOW_RUN_1, GlacierTransferModel.StatusCode.REQUESTED)
+    new_image = mock_image(WORKFLOW_RUN_1, GlacierTransferModel.StatusCode.DOWNLOADED)
+
+    controller.increase_archive_status_metric_counter(new_image, old_image)
+
+    assert WORKFLOW_RUN_1 not in controller.workflow_run_metrics
+
+
+def test_iter_image_pairs() -> None:
+    new_image = mock_image(WORKFLOW_RUN_1, GlacierTransferModel.StatusCode.STAGED)
+    old_image = mock_image(WORKFLOW_RUN_1, GlacierTransferModel.StatusCode.REQUESTED)
+    records: List[dict[str, Any]] = [
+        {
+            "eventName": "INSERT",
+            "eventSource": "aws:dynamodb",
+            "dynamodb": {"NewImage": new_image},
+        },
+        {
+            "eventName": "MODIFY",
+            "eventSource": "aws:dynamodb",
+            "dynamodb": {"NewImage": new_image, "OldImage": old_image},
+        },
+        {
+            "eventName": "REMOVE",
+            "eventSource": "aws:dynamodb",
+            "dynamodb": {"OldImage": old_image},
+        },
+        {"eventName": "INSERT", "eventSource": "aws:sqs"},
+    ]
+
+    assert list(status_controller._iter_image_pairs(records)) == [
+        (new_image, None),
+        (new_image, old_image),
+    ]
+
+
+def test_increase_archive_status_metric_counter_reads_only_old_status() -> None:
+    controller = StatusMetricController(records=[])
+
+    # The old image is not parsed into a model, so only retrieve_status is required
+    old_image = {
+        "retrieve_status": {
+            "S": f"{WORKFLOW_RUN_1}/{GlacierTransferModel.StatusCode.STAGED}"
+        }
+    }
+    new_image = mock_image(WORKFLOW_RUN_1, GlacierTransferModel.StatusCode.DOWNLOADED)
 
-    assert controller.workflow_run_metrics[WORKFLOW_RUN_1]["requested_count"] == 1
+    controller.increase_archive_status_metric_counter(new_image, old_image)
+
+    metrics = controller.workflow_run_metrics[WORKFLOW_RUN_1]
+    assert metrics[status_controller.DOWNLOADED_COUNT] == 1
+    assert metrics[status_controller.DOWNLOADED_SIZE] == ARCHIVE_SIZE
+
+
+@patch("solution.application.metrics.status_controller._get_ddb_client")
+def test_update_metric_query_logs_summary(
+    ddb_client_mock: MagicMock,
+    mock_records: List[dict[str, Any]],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    controller = StatusMetricController(records=mock_records)
+    with caplog.at_level(logging.INFO):
+        controller.handle_archive_status_changed()
+
+    # Every fixture record is a counted transition
     assert (
-        controller.workflow_run_metrics[WORKFLOW_RUN_1]["requested_size"]
-        == ARCHIVE_SIZE
+        f"Counted {len(mock_records)} status transitions across 2 workflow runs"
+        in caplog.messages
     )
-    assert controller.workflow_run_metrics[WORKFLOW_RUN_1]["staged_count"] == 1
+
+
+def test_token_is_deterministic(mock_records: List[dict[str, Any]]) -> None:
+    # A redelivered stream batch must produce the same token
     assert (
-        controller.workflow_run_metrics[WORKFLOW_RUN_1]["staged_size"] == ARCHIVE_SIZE
+        StatusMetricController(records=mock_records).client_request_token
+        == StatusMetricController(records=list(mock_records)).client_request_token
     )
@@ -6,6 +6,7 @@ SPDX-License-Identifier: Apache-2.0
 from solution.application.model.glacier_transfer_meta_model import (
     GlacierTransferMetadata,
     GlacierTransferMetadataRead,
+    GlacierTransferMetadataStatus,
 )
 
 
@@ -52,3 +53,28 @@ def test_glacier_transfer_metadata_read_model() -> None:
     assert marshaled["sk"]["S"] == "meta"
     assert len(marshaled) == 2
     assert GlacierTransferMetadataRead.parse(marshaled).marshal() == marshaled
+
+
+def test_glacier_transfer_metadata_status_model() -> None:
+    metadata_model = GlacierTransferMetadata(
+        workflow_run="run_id",
+        glacier_object_id="object_id",
+        job_id="job_id",
+        start_time="start_time",
+        vault_name="vault_name",
+        retrieval_type="archive-retrieval",
+        file_name="inventory",
+        s3_storage_class="GLACIER",
+        retrieve_status="run_id/staged",
+        description="test_description",
+        size=2023,
+        archive_id="object_id",
+    )
+    status_model = GlacierTransferMetadataStatus.parse(metadata_model.marshal())
+    assert status_model.workflow_run == "run_id"
+    assert status_model.retrieval_type == "archive-retrieval"
+    assert status_model.retrieve_status == "run_id/staged"
+    assert status_model.status_suffix == "staged"
+    assert status_model.size == 2023
+    assert status_model.archive_id == "object_id"
+    assert len(status_model.marshal()) == 6